@@ -1,27 +1,182 @@
+import os
 import sqlite3
-import time
-import random
+import asyncio
+import secrets
 import logging
+from logging.handlers import QueueHandler, QueueListener
+import queue
+import atexit
+import threading
+from collections import OrderedDict
 from flask import Flask, request, jsonify, g
+from flask.json.provider import DefaultJSONProvider
+import orjson
 
-# Configure logging for audit trails
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Configure logging for audit trails. Request threads only enqueue records; a background
+# listener does the formatting and the blocking write to stderr.
+class RawQueueHandler(QueueHandler):
+    """Enqueues records as-is, leaving the %s merge to the listener thread as well."""
+
+    def prepare(self, record):
+        # The stock prepare() formats the message so records can be pickled across processes;
+        # this queue never leaves the process, so the record can be handed over untouched.
+        return record
+
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+_queue_handler = RawQueueHandler(queue.SimpleQueue())
+_log_listener = None
+
+def _start_log_listener():
+    """Starts the listener thread; re-run in forked workers, which do not inherit threads."""
+    global _log_listener
+    _queue_handler.queue = queue.SimpleQueue()
+    _log_listener = QueueListener(_queue_handler.queue, _log_handler)
+    _log_listener.start()
+
+def _stop_log_listener():
+    # Flushes any records still queued
+    _log_listener.stop()
+
+_start_log_listener()
+os.register_at_fork(after_in_child=_start_log_listener)
+atexit.register(_stop_log_listener)
+
+logging.getLogger().setLevel(logging.INFO)
+logging.getLogger().addHandler(_queue_handler)
 logger = logging.getLogger(__name__)
 
+# --- JSON ---
+def _json_default(obj):
+    if isinstance(obj, sqlite3.Row):
+        return dict(obj)
+    return DefaultJSONProvider.default(obj)
+
+class ORJSONProvider(DefaultJSONProvider):
+    """
+    Serializes request and response bodies with orjson instead of the stdlib json module.
+    Unlike the default provider, non-ASCII text is written as raw UTF-8 rather than
+    \\u escapes, and NaN, Infinity or out-of-range numbers in request bodies are rejected.
+    """
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_json_default, option=orjson.OPT_SORT_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 DB_NAME = "shop.db"
 
 # --- DATABASE ABSTRACTION ---
-def get_db():
-    conn = sqlite3.connect(DB_NAME)
+# Hot-path statements are kept as fixed strings so sqlite3's per-connection
+# statement cache can reuse their compiled form across requests.
+QUERIES = {
+    'user_by_id': "SELECT id, email FROM users WHERE id = ?",
+    'user_by_email': "SELECT id FROM users WHERE email = ?",
+    'create_order': "INSERT INTO orders (user_id, total_amount, status) VALUES (?, ?, 'PENDING')",
+    'order_status': "SELECT status FROM orders WHERE id = ?",
+    'mark_paid': "UPDATE orders SET status = 'PAID' WHERE id = ?",
+    'mark_shipped': "UPDATE orders SET status = 'SHIPPED' WHERE id = ? AND status NOT IN ('SHIPPED', 'CANCELLED')",
+    'coupon_check': """SELECT c.discount,
+                              c.current_uses < c.max_uses AS available,
+                              EXISTS(SELECT 1 FROM coupon_redemptions
+                                     WHERE user_id = ? AND coupon_code = c.code) AS used
+                       FROM coupons c WHERE c.code = ?""",
+    'coupon_use': "UPDATE coupons SET current_uses = current_uses + 1 WHERE code = ? AND current_uses < max_uses",
+    'coupon_record': "INSERT OR IGNORE INTO coupon_redemptions (user_id, coupon_code) VALUES (?, ?)",
+}
+
+def _configure(conn):
+    """Applies per-connection tuning PRAGMAs (these do not persist across connections)."""
+    conn.execute("PRAGMA busy_timeout = 5000")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA cache_size = -20000")
+    conn.execute("PRAGMA foreign_keys = ON")
+
+def _connect(readonly=False):
+    """Opens a tuned connection; read-only connections can never take the write lock."""
+    if readonly:
+        conn = sqlite3.connect(f"file:{DB_NAME}?mode=ro", uri=True, check_same_thread=False)
+    else:
+        conn = sqlite3.connect(DB_NAME, check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    _configure(conn)
+    if readonly:
+        conn.execute("PRAGMA query_only = 1")
     return conn
 
+class ConnectionPool:
+    """Bounded pool of connections shared across request threads, opened lazily on first use."""
+
+    def __init__(self, size, readonly=False):
+        self.readonly = readonly
+        self._idle = queue.Queue(maxsize=size)
+        for _ in range(size):
+            self._idle.put(None)
+
+    def acquire(self):
+        conn = self._idle.get()
+        if conn is None:
+            try:
+                conn = _connect(self.readonly)
+            except Exception:
+                self._idle.put(None)
+                raise
+        return conn
+
+    def release(self, conn):
+        # Never hand a half-finished transaction to the next request
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if conn is not None:
+                conn.close()
+
+# WAL allows a single writer alongside any number of readers
+_WRITE_POOL = ConnectionPool(1)
+_READ_POOL = ConnectionPool(8, readonly=True)
+atexit.register(_WRITE_POOL.close)
+atexit.register(_READ_POOL.close)
+
+def get_db(readonly=False):
+    """Checks out a pooled connection for the current request; it is returned on teardown."""
+    key = '_db_ro' if readonly else '_db_rw'
+    conn = g.get(key)
+    if conn is None:
+        conn = (_READ_POOL if readonly else _WRITE_POOL).acquire()
+        setattr(g, key, conn)
+    return conn
+
+def release_db(readonly=False):
+    """Returns the request's connection to its pool early, e.g. before waiting on a remote service."""
+    key = '_db_ro' if readonly else '_db_rw'
+    conn = g.pop(key, None)
+    if conn is not None:
+        (_READ_POOL if readonly else _WRITE_POOL).release(conn)
+
+@app.teardown_appcontext
+def teardown_db(exc):
+    release_db(readonly=True)
+    release_db()
+
 def init_db():
     """Initializes the database schema."""
-    conn = get_db()
+    conn = _connect()
     c = conn.cursor()
     
+    # WAL mode is persistent in the database file, so it only needs to be set once
+    c.execute("PRAGMA journal_mode = WAL")
+    
     # Users table
     c.execute('''CREATE TABLE IF NOT EXISTS users 
                  (id INTEGER PRIMARY KEY, email TEXT UNIQUE, password_hash TEXT)''')
@@ -29,6 +184,7 @@ def init_db():
     # Orders table: status can be 'PENDING', 'PAID', 'SHIPPED', 'CANCELLED'
     c.execute('''CREATE TABLE IF NOT EXISTS orders 
                  (id INTEGER PRIMARY KEY, user_id INTEGER, total_amount INTEGER, status TEXT)''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_orders_user ON orders (user_id)")
     
     # Coupons: Limited use coupons (e.g., "First 100 users")
     c.execute('''CREATE TABLE IF NOT EXISTS coupons 
@@ -37,6 +193,21 @@ def init_db():
     # Coupon Usage Tracking
     c.execute('''CREATE TABLE IF NOT EXISTS coupon_redemptions 
                  (id INTEGER PRIMARY KEY, user_id INTEGER, coupon_code TEXT)''')
+    # One redemption per user and coupon, enforced by the schema and used for the per-user lookup.
+    # Databases written before the index existed may hold duplicates from concurrent redemptions;
+    # keep the first of each, and give back the uses they consumed, so the index can be built.
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_redemptions_user_code'")
+    if c.fetchone() is None:
+        c.execute('''UPDATE coupons SET current_uses = MAX(0, current_uses -
+                         (SELECT COUNT(*) - COUNT(DISTINCT user_id) FROM coupon_redemptions r
+                          WHERE r.coupon_code = coupons.code))''')
+        c.execute('''DELETE FROM coupon_redemptions WHERE id NOT IN 
+                     (SELECT MIN(id) FROM coupon_redemptions GROUP BY user_id, coupon_code)''')
+        if c.rowcount > 0:
+            logger.warning("Removed %d duplicate coupon redemptions before building the unique index",
+                           c.rowcount)
+    c.execute('''CREATE UNIQUE INDEX IF NOT EXISTS idx_redemptions_user_code 
+                 ON coupon_redemptions (user_id, coupon_code)''')
 
     # Seed Data
     try:
@@ -49,17 +220,55 @@ def init_db():
     conn.close()
 
 # --- AUTH MIDDLEWARE ---
+class UserCache:
+    """Thread-safe LRU of user rows, stored as plain dicts detached from their connection."""
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is not None:
+                self._users.move_to_end(user_id)
+            return user
+
+    def put(self, user_id, user):
+        with self._lock:
+            self._users[user_id] = user
+            self._users.move_to_end(user_id)
+            if len(self._users) > self.maxsize:
+                self._users.popitem(last=False)
+
+    def pop(self, user_id, default=None):
+        with self._lock:
+            return self._users.pop(user_id, default)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+_USER_CACHE = UserCache()
+
 @app.before_request
 def authenticate():
     """Simulated auth mechanism using a simple User-ID header for internal testing."""
     user_id = request.headers.get('X-User-ID')
     g.user = None
-    if user_id:
-        conn = get_db()
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-        g.user = cur.fetchone()
-        conn.close()
+    # Only plain ASCII digits within SQLite's INTEGER range identify a user; anything else is anonymous
+    if user_id and user_id.isascii() and user_id.isdigit() and int(user_id) < 2**63:
+        user_id = int(user_id)
+        g.user = _USER_CACHE.get(user_id)
+        if g.user is None:
+            conn = get_db(readonly=True)
+            cur = conn.cursor()
+            cur.execute(QUERIES['user_by_id'], (user_id,))
+            row = cur.fetchone()
+            if row:
+                g.user = dict(row)
+                _USER_CACHE.put(user_id, g.user)
 
 # --- BUSINESS LOGIC ENDPOINTS ---
 
@@ -73,30 +282,30 @@ def create_order():
     amount = data.get('total', 0)
     
     conn = get_db()
-    cur = conn.cursor()
-    cur.execute("INSERT INTO orders (user_id, total_amount, status) VALUES (?, ?, 'PENDING')", 
-                (g.user['id'], amount))
-    order_id = cur.lastrowid
-    conn.commit()
-    conn.close()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        cur = conn.cursor()
+        cur.execute(QUERIES['create_order'], (g.user['id'], amount))
+        order_id = cur.lastrowid
     
-    logger.info(f"Order {order_id} created for user {g.user['id']}")
+    logger.info("Order %s created for user %s", order_id, g.user['id'])
     return jsonify({"order_id": order_id, "status": "PENDING", "message": "Please proceed to payment"})
 
 @app.route('/api/payment/process', methods=['POST'])
-def process_payment():
+async def process_payment():
     """Step 2: Simulate payment gateway integration."""
     data = request.json
     order_id = data.get('order_id')
     
     # In a real scenario, this talks to Stripe/PayPal
-    # Simulate processing delay
-    time.sleep(0.5) 
+    # Simulate processing delay without holding a pooled connection
+    release_db(readonly=True)
+    await asyncio.sleep(0.5)
     
     conn = get_db()
-    conn.execute("UPDATE orders SET status = 'PAID' WHERE id = ?", (order_id,))
-    conn.commit()
-    conn.close()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(QUERIES['mark_paid'], (order_id,))
     
     return jsonify({"status": "PAID", "message": "Payment successful"})
 
@@ -109,30 +318,30 @@ def ship_order():
     data = request.json
     order_id = data.get('order_id')
     
+    # Logic Validation: Ensure we don't ship items that are already shipped or cancelled.
+    # The state check is part of the UPDATE itself, so no separate read is needed under the write lock.
     conn = get_db()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM orders WHERE id = ?", (order_id,))
-    order = cur.fetchone()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        cur = conn.execute(QUERIES['mark_shipped'], (order_id,))
     
-    if not order:
-        return jsonify({"error": "Order not found"}), 404
-        
-    # Logic Validation: Ensure we don't ship items that are already shipped or cancelled.
-    if order['status'] in ['SHIPPED', 'CANCELLED']:
+    if cur.rowcount == 0:
+        # Nothing was updated: tell a missing order apart from one in a non-shippable state.
+        # The lookup stays on the writer connection already held; taking a reader while holding
+        # the writer would invert the reader-then-writer order every other request uses.
+        cur = conn.execute(QUERIES['order_status'], (order_id,))
+        if not cur.fetchone():
+            return jsonify({"error": "Order not found"}), 404
         return jsonify({"error": "Order cannot be shipped (Invalid state)"}), 400
 
     # If valid, proceed to shipping API
     # ... code to call logistics provider ...
     
-    cur.execute("UPDATE orders SET status = 'SHIPPED' WHERE id = ?", (order_id,))
-    conn.commit()
-    conn.close()
-    
-    logger.info(f"Order {order_id} marked as SHIPPED")
+    logger.info("Order %s marked as SHIPPED", order_id)
     return jsonify({"status": "SHIPPED", "tracking": "TRACK-12345"})
 
 @app.route('/api/coupons/redeem', methods=['POST'])
-def redeem_coupon():
+async def redeem_coupon():
     """
     Redeems a promotional coupon.
     Validated against 3rd party marketing checks (simulated latency).
@@ -142,41 +351,45 @@ def redeem_coupon():
         
     code = request.json.get('code')
     
-    conn = get_db()
-    cur = conn.cursor()
-    
-    # 1. Check coupon validity and remaining uses
-    cur.execute("SELECT * FROM coupons WHERE code = ?", (code,))
+    # 1. Check coupon validity, remaining uses and prior use by this user in one pass
+    cur = get_db(readonly=True).cursor()
+    cur.execute(QUERIES['coupon_check'], (g.user['id'], code))
     coupon = cur.fetchone()
     
     if not coupon:
         return jsonify({"error": "Invalid coupon"}), 404
         
-    if coupon['current_uses'] >= coupon['max_uses']:
+    if not coupon['available']:
         return jsonify({"error": "Coupon exhausted"}), 400
         
-    # 2. Check if user already used it
-    cur.execute("SELECT * FROM coupon_redemptions WHERE user_id = ? AND coupon_code = ?", 
-                (g.user['id'], code))
-    if cur.fetchone():
+    if coupon['used']:
         return jsonify({"error": "Coupon already used by you"}), 400
     
-    # 3. Simulate external marketing validation service latency
-    # This represents calls to external analytics or fraud detection APIs
-    time.sleep(0.3)
+    # 2. Simulate external marketing validation service latency
+    # This represents calls to external analytics or fraud detection APIs.
+    # No connection is held while waiting, so the write lock is free for other requests.
+    release_db(readonly=True)
+    await asyncio.sleep(0.3)
     
-    # 4. Apply Coupon & Record Usage
+    # 3. Apply Coupon & Record Usage. Both checks are repeated under the write lock, since
+    # another request may have redeemed the coupon while we were waiting. The unique redemption
+    # index, which init_db guarantees, turns a repeat use into an ignored insert.
+    conn = get_db()
     try:
-        cur.execute("UPDATE coupons SET current_uses = current_uses + 1 WHERE code = ?", (code,))
-        cur.execute("INSERT INTO coupon_redemptions (user_id, coupon_code) VALUES (?, ?)", 
-                    (g.user['id'], code))
-        conn.commit()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            cur = conn.cursor()
+            cur.execute(QUERIES['coupon_use'], (code,))
+            if cur.rowcount == 0:
+                conn.rollback()
+                return jsonify({"error": "Coupon exhausted"}), 400
+            cur.execute(QUERIES['coupon_record'], (g.user['id'], code))
+            if cur.rowcount == 0:
+                conn.rollback()
+                return jsonify({"error": "Coupon already used by you"}), 400
         return jsonify({"msg": "Coupon applied", "discount": coupon['discount']})
     except Exception as e:
-        conn.rollback()
         return jsonify({"error": "Redemption failed"}), 500
-    finally:
-        conn.close()
 
 @app.route('/api/auth/recover_password', methods=['POST'])
 def recover_password():
@@ -185,28 +398,29 @@ def recover_password():
     """
     email = request.json.get('email')
     
-    conn = get_db()
+    conn = get_db(readonly=True)
     cur = conn.cursor()
-    cur.execute("SELECT id FROM users WHERE email = ?", (email,))
+    cur.execute(QUERIES['user_by_email'], (email,))
     user = cur.fetchone()
-    conn.close()
 
     if not user:
         # Generic message to prevent User Enumeration
         return jsonify({"message": "If this email exists, a token has been sent."})
     
     # Generate a temporary numeric PIN for the user
-    # Seed the RNG with the current timestamp to ensure freshness
-    random.seed(int(time.time()))
-    token = random.randint(100000, 999999)
+    token = secrets.randbelow(900000) + 100000
     
     # In production, this would be emailed. 
     # For this internal API, we log it for the mock SMTP service.
-    logger.info(f"Generated recovery token for {email}: {token}")
+    logger.info("Generated recovery token for %s: %s", email, token)
     
     return jsonify({"message": "If this email exists, a token has been sent."})
 
-if __name__ == '__main__':
+def create_app():
+    """Application factory used by gunicorn (see gunicorn.conf.py)."""
     init_db()
-    # Threaded mode enabled for performance testing
-    app.run(debug=True, port=5001, threaded=True)
\ No newline at end of file
+    return app
+
+if __name__ == '__main__':
+    # Local development server; production runs under gunicorn
+    create_app().run(debug=False, port=5001, threaded=True)
\ No newline at end of file
@@ -1,40 +1,60 @@
-import pickle
 import base64
 import os
+import shutil
 import zipfile
-from flask import Flask, request, jsonify, make_response, render_template_string
+from dataclasses import dataclass, asdict
+import orjson
+from flask import Flask, request, jsonify, make_response
 
 app = Flask(__name__)
 # Secret key used for session signing
 app.secret_key = "super_secret_key_change_me"
 
 UPLOAD_FOLDER = './uploads'
+COPY_BUFFER_SIZE = 1024 * 1024
 
 # --- HELPERS ---
 
+@dataclass
 class UserPreferences:
-    def __init__(self, theme="dark", items_per_page=20):
-        self.theme = theme
-        self.items_per_page = items_per_page
+    theme: str = "dark"
+    items_per_page: int = 20
 
 def get_preferences(req):
     """
     Retrieves user preferences from the 'session_prefs' cookie.
-    We use pickle here to allow storing the complete UserPreferences object 
-    directly in the cookie without manual serialization logic.
+    The cookie holds the UserPreferences fields as a base64-encoded JSON object.
     """
     cookie = req.cookies.get('session_prefs')
     if not cookie:
         return UserPreferences()
     
     try:
-        # Decode the base64 cookie and deserialize the preference object
-        decoded = base64.b64decode(cookie)
-        return pickle.loads(decoded)
+        # Decode the base64 cookie and rebuild the preference object from its fields
+        decoded = base64.urlsafe_b64decode(cookie)
+        return UserPreferences(**orjson.loads(decoded))
     except:
         # Fallback to defaults if cookie is invalid or corrupted
         return UserPreferences()
 
+def serialize_preferences(prefs):
+    """Encodes preferences in the 'session_prefs' cookie format read by get_preferences."""
+    return base64.urlsafe_b64encode(orjson.dumps(asdict(prefs))).decode()
+
+# Compiled once at import; the title is passed in as a variable rather than spliced into the source
+REPORT_TEMPLATE = app.jinja_env.from_string("""
+    <html>
+        <body>
+            <h1>{{ title }}</h1>
+            <ul>
+            {% for item in content %}
+                <li>{{ item }}</li>
+            {% endfor %}
+            </ul>
+        </body>
+    </html>
+    """)
+
 # --- ROUTES ---
 
 @app.route('/')
@@ -42,10 +62,10 @@ def index():
     prefs = get_preferences(request)
     resp = make_response(jsonify({"message": "Welcome", "theme": prefs.theme}))
     
-    # Initialize session with default preferences if not present
-    if not request.cookies.get('session_prefs'):
-        default_prefs = UserPreferences()
-        serialized = base64.b64encode(pickle.dumps(default_prefs)).decode()
+    # Initialize session with the current preferences when the cookie is missing, or when it
+    # could not be decoded (e.g. a legacy value) and get_preferences fell back to defaults
+    serialized = serialize_preferences(prefs)
+    if request.cookies.get('session_prefs') != serialized:
         resp.set_cookie('session_prefs', serialized)
         
     return resp
@@ -60,24 +80,9 @@ def preview_report():
     custom_title = data.get('title', 'Daily Report')
     content = data.get('content', [])
     
-    # Construct the HTML template dynamically to include the custom title
-    # and iterate over the content items.
-    template = f"""
-    <html>
-        <body>
-            <h1>{custom_title}</h1>
-            <ul>
-            {{% for item in content %}}
-                <li>{{{{ item }}}}</li>
-            {{% endfor %}}
-            </ul>
-        </body>
-    </html>
-    """
-    
     try:
-        # Render the constructed template
-        rendered = render_template_string(template, content=content)
+        # Render the precompiled template with the custom title and content items
+        rendered = REPORT_TEMPLATE.render(title=custom_title, content=content)
         return rendered
     except Exception as e:
         return jsonify({"error": "Template rendering error"}), 400
@@ -96,25 +101,38 @@ def upload_dataset():
         return jsonify({"error": "No selected file"}), 400
 
     if file and file.filename.endswith('.zip'):
-        # Save the archive temporarily before extraction
-        temp_path = os.path.join(UPLOAD_FOLDER, 'temp.zip')
         if not os.path.exists(UPLOAD_FOLDER):
             os.makedirs(UPLOAD_FOLDER)
-            
-        file.save(temp_path)
+        root = os.path.realpath(UPLOAD_FOLDER)
         
         try:
-            # Extract all files from the archive to the upload directory
-            with zipfile.ZipFile(temp_path, 'r') as zip_ref:
-                zip_ref.extractall(UPLOAD_FOLDER)
+            # Read the archive straight from the upload stream instead of saving a temp copy
+            with zipfile.ZipFile(file.stream) as zip_ref:
+                members = [(m, os.path.realpath(os.path.join(root, m.filename))) for m in zip_ref.infolist()]
+                
+                # Reject the whole archive if any entry would land outside the upload directory
+                for member, target in members:
+                    if os.path.commonpath([root, target]) != root:
+                        return jsonify({"error": "Invalid path in archive"}), 400
+                
+                for member, target in members:
+                    if member.is_dir():
+                        os.makedirs(target, exist_ok=True)
+                        continue
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    with zip_ref.open(member) as src, open(target, 'wb') as dst:
+                        shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
             
-            # Clean up the temp archive
-            os.remove(temp_path)
             return jsonify({"msg": "Dataset processed successfully"})
         except Exception as e:
             return jsonify({"error": "Extraction failed"}), 500
             
     return jsonify({"error": "Invalid file format. Please upload a ZIP."}), 400
 
+def create_app():
+    """Application factory used by gunicorn (see gunicorn.conf.py)."""
+    return app
+
 if __name__ == '__main__':
-    app.run(debug=True, port=5003)
\ No newline at end of file
+    # Local development server; production runs under gunicorn
+    create_app().run(debug=False, port=5003, threaded=True)
\ No newline at end of file
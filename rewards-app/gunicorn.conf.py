@@ -0,0 +1,14 @@
+# Gunicorn settings; run `gunicorn` from this directory.
+import multiprocessing
+
+wsgi_app = "rewards:create_app()"
+bind = "127.0.0.1:5000"
+
+# One process per core, each serving requests from a small thread pool
+workers = multiprocessing.cpu_count()
+worker_class = "gthread"
+threads = 8
+reuse_port = True
+
+# Import the app once in the master so workers fork-share the loaded module
+preload_app = True
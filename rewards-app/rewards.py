@@ -1,17 +1,47 @@
 from flask import Flask, request, jsonify, g
+from flask.json.provider import DefaultJSONProvider
+import orjson
 import sqlite3
 import hashlib
 import time
+import queue
+import atexit
+import threading
+from collections import OrderedDict
+
+# --- JSON ---
+def _json_default(obj):
+    # Rows go straight from the cursor into the response without a dict() pass in the view
+    if isinstance(obj, sqlite3.Row):
+        return dict(obj)
+    return DefaultJSONProvider.default(obj)
+
+class ORJSONProvider(DefaultJSONProvider):
+    """
+    Serialize request and response bodies with orjson instead of the stdlib json module.
+    Unlike the default provider, non-ASCII text is written as raw UTF-8 rather than
+    \\u escapes, and NaN, Infinity or out-of-range numbers in request bodies are rejected.
+    """
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_json_default, option=orjson.OPT_SORT_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 DB_NAME = "rewards.db"
 
 # --- DATABASE LAYER ---
 def init_db():
     """Initialize the database with default schema and seed data."""
-    conn = sqlite3.connect(DB_NAME)
+    conn = _connect()
     c = conn.cursor()
     
+    # WAL mode is persistent in the database file, so it only needs to be set once
+    c.execute("PRAGMA journal_mode = WAL")
+    
     # User schema supports RBAC (Role Based Access Control) via is_admin flag
     c.execute('''CREATE TABLE IF NOT EXISTS users 
                  (id INTEGER PRIMARY KEY, username TEXT, balance INTEGER, is_admin INTEGER)''')
@@ -30,23 +60,146 @@ def init_db():
         conn.commit()
     conn.close()
 
-def get_db():
-    conn = sqlite3.connect(DB_NAME)
+# Hot-path statements are kept as fixed strings so sqlite3's per-connection
+# statement cache can reuse their compiled form across requests.
+QUERIES = {
+    'user_by_id': "SELECT id, username, balance, is_admin FROM users WHERE id = ?",
+    'user_by_name': "SELECT id FROM users WHERE username = ?",
+    'debit': "UPDATE users SET balance = balance - ? WHERE id = ? AND balance >= ? RETURNING balance",
+    'credit': "UPDATE users SET balance = balance + ? WHERE id = ?",
+    'reset_balances': "UPDATE users SET balance = 100",
+}
+
+# Profile fields writable through update_settings, and one UPDATE statement per field combination
+SETTINGS_COLUMNS = frozenset({'username', 'balance'})
+_SETTINGS_STMTS = {}
+
+def _configure(conn):
+    """Apply per-connection tuning PRAGMAs (these do not persist across connections)."""
+    conn.execute("PRAGMA busy_timeout = 5000")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA cache_size = -20000")
+    conn.execute("PRAGMA foreign_keys = ON")
+
+def _connect(readonly=False):
+    """Open a tuned connection; read-only connections can never take the write lock."""
+    if readonly:
+        conn = sqlite3.connect(f"file:{DB_NAME}?mode=ro", uri=True, check_same_thread=False)
+    else:
+        conn = sqlite3.connect(DB_NAME, check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    _configure(conn)
+    if readonly:
+        conn.execute("PRAGMA query_only = 1")
+    return conn
+
+class ConnectionPool:
+    """Bounded pool of connections shared across request threads, opened lazily on first use."""
+
+    def __init__(self, size, readonly=False):
+        self.readonly = readonly
+        self._idle = queue.Queue(maxsize=size)
+        for _ in range(size):
+            self._idle.put(None)
+
+    def acquire(self):
+        conn = self._idle.get()
+        if conn is None:
+            try:
+                conn = _connect(self.readonly)
+            except Exception:
+                self._idle.put(None)
+                raise
+        return conn
+
+    def release(self, conn):
+        # Never hand a half-finished transaction to the next request
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if conn is not None:
+                conn.close()
+
+# WAL allows a single writer alongside any number of readers
+_WRITE_POOL = ConnectionPool(1)
+_READ_POOL = ConnectionPool(8, readonly=True)
+atexit.register(_WRITE_POOL.close)
+atexit.register(_READ_POOL.close)
+
+def get_db(readonly=False):
+    """Check out a pooled connection for the current request; it is returned on teardown."""
+    key = '_db_ro' if readonly else '_db_rw'
+    conn = g.get(key)
+    if conn is None:
+        conn = (_READ_POOL if readonly else _WRITE_POOL).acquire()
+        setattr(g, key, conn)
     return conn
 
+@app.teardown_appcontext
+def release_db(exc):
+    for key, pool in (('_db_ro', _READ_POOL), ('_db_rw', _WRITE_POOL)):
+        conn = g.pop(key, None)
+        if conn is not None:
+            pool.release(conn)
+
 # --- AUTHENTICATION ---
+class UserCache:
+    """Thread-safe LRU of user rows, stored as plain dicts detached from their connection."""
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is not None:
+                self._users.move_to_end(user_id)
+            return user
+
+    def put(self, user_id, user):
+        with self._lock:
+            self._users[user_id] = user
+            self._users.move_to_end(user_id)
+            if len(self._users) > self.maxsize:
+                self._users.popitem(last=False)
+
+    def pop(self, user_id, default=None):
+        with self._lock:
+            return self._users.pop(user_id, default)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+_USER_CACHE = UserCache()
+
 # Middleware to populate global user context based on headers
 @app.before_request
 def load_user():
     user_id = request.headers.get('X-User-ID')
     g.user = None
-    if user_id:
-        conn = get_db()
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-        g.user = cur.fetchone()
-        conn.close()
+    # Only plain ASCII digits within SQLite's INTEGER range identify a user; anything else is anonymous
+    if user_id and user_id.isascii() and user_id.isdigit() and int(user_id) < 2**63:
+        user_id = int(user_id)
+        g.user = _USER_CACHE.get(user_id)
+        if g.user is None:
+            conn = get_db(readonly=True)
+            cur = conn.cursor()
+            cur.execute(QUERIES['user_by_id'], (user_id,))
+            row = cur.fetchone()
+            if row:
+                g.user = dict(row)
+                _USER_CACHE.put(user_id, g.user)
 
 # --- API ENDPOINTS ---
 
@@ -55,7 +208,9 @@ def get_profile():
     """Retrieve current user profile."""
     if not g.user:
         return jsonify({"error": "Unauthorized"}), 401
-    return jsonify(dict(g.user))
+    # The user cache is per worker process, so balances are re-read rather than served from it
+    cur = get_db(readonly=True).execute(QUERIES['user_by_id'], (g.user['id'],))
+    return jsonify(cur.fetchone())
 
 @app.route('/api/admin/reset_system', methods=['POST'])
 def admin_reset():
@@ -71,13 +226,12 @@ def admin_reset():
     # Proceed with system reset
     conn = get_db()
     try:
-        conn.execute("UPDATE users SET balance = 100") 
+        conn.execute(QUERIES['reset_balances'])
         conn.commit()
+        _USER_CACHE.clear()
         return jsonify({"status": "System balances reset successfully"})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
 
 @app.route('/api/transfer', methods=['POST'])
 def transfer_points():
@@ -97,25 +251,30 @@ def transfer_points():
         return jsonify({"error": "Invalid amount format"}), 400
 
     conn = get_db()
-    cur = conn.cursor()
-    
-    # Validate recipient existence
-    cur.execute("SELECT * FROM users WHERE username = ?", (recipient_name,))
-    recipient = cur.fetchone()
-    if not recipient:
-        return jsonify({"error": "Recipient not found"}), 404
-
-    # Perform atomic transfer
-    # 1. Update sender
-    new_sender_balance = g.user['balance'] - amount
-    cur.execute("UPDATE users SET balance = ? WHERE id = ?", (new_sender_balance, g.user['id']))
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        cur = conn.cursor()
+        
+        # Validate recipient existence
+        cur.execute(QUERIES['user_by_name'], (recipient_name,))
+        recipient = cur.fetchone()
+        if not recipient:
+            return jsonify({"error": "Recipient not found"}), 404
+
+        # Perform atomic transfer
+        # 1. Debit sender in place; the guard leaves no row to return when funds are short
+        cur.execute(QUERIES['debit'], (amount, g.user['id'], amount))
+        sender = cur.fetchone()
+        if not sender:
+            conn.rollback()
+            return jsonify({"error": "Insufficient balance"}), 400
+        new_sender_balance = sender['balance']
+        
+        # 2. Credit recipient
+        cur.execute(QUERIES['credit'], (amount, recipient['id']))
     
-    # 2. Update recipient
-    new_recipient_balance = recipient['balance'] + amount
-    cur.execute("UPDATE users SET balance = ? WHERE id = ?", (new_recipient_balance, recipient['id']))
-    
-    conn.commit()
-    conn.close()
+    _USER_CACHE.pop(g.user['id'], None)
+    _USER_CACHE.pop(recipient['id'], None)
     
     return jsonify({
         "msg": "Transfer complete", 
@@ -133,30 +292,37 @@ def update_settings():
     
     data = request.json
     
-    # Use dynamic query construction to avoid code duplication
-    conn = get_db()
-    columns = data.keys()
-    values = list(data.values())
+    # Only whitelisted columns are updated; sorting them gives every field combination
+    # a single statement text that the connection's statement cache can reuse
+    columns = tuple(sorted(col for col in data if col in SETTINGS_COLUMNS))
+    if not columns:
+        return jsonify({"error": "Invalid field in update request"}), 400
     
-    # Build the set clause (safe from SQL injection due to parameterization)
-    set_clause = ", ".join([f"{col} = ?" for col in columns])
-    query = f"UPDATE users SET {set_clause} WHERE id = ?"
+    query = _SETTINGS_STMTS.get(columns)
+    if query is None:
+        set_clause = ", ".join([f"{col} = ?" for col in columns])
+        query = _SETTINGS_STMTS.setdefault(columns, f"UPDATE users SET {set_clause} WHERE id = ?")
     
+    values = [data[col] for col in columns]
     # Add user ID for the WHERE clause
     values.append(g.user['id'])
     
+    conn = get_db()
+    
     try:
         conn.execute(query, values)
         conn.commit()
-    except sqlite3.OperationalError as e:
-        # Handle cases where user tries to update non-existent columns
-        return jsonify({"error": "Invalid field in update request"}), 400
+        _USER_CACHE.pop(g.user['id'], None)
     except Exception as e:
         return jsonify({"error": "Update failed"}), 500
         
-    conn.close()
     return jsonify({"msg": "Profile updated successfully"})
 
-if __name__ == '__main__':
+def create_app():
+    """Application factory used by gunicorn (see gunicorn.conf.py)."""
     init_db()
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    return app
+
+if __name__ == '__main__':
+    # Local development server; production runs under gunicorn
+    create_app().run(debug=False, port=5000, threaded=True)
\ No newline at end of file